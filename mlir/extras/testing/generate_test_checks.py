@@ -2,8 +2,11 @@
 # See https://llvm.org/LICENSE.txt for license information.
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
+import functools
 import io
 import re
+import string
+from typing import Dict, List
 
 ADVERT_BEGIN = "// NOTE: Assertions have been autogenerated by "
 ADVERT_END = """
@@ -13,75 +16,100 @@ ADVERT_END = """
 // minimized and named to reflect the test intent.
 """
 
+# Characters an SSA identifier may start with (besides digits, which start a
+# purely numeric name) and continue with.
+SSA_DIGITS = string.digits
+SSA_START_CHARS = string.ascii_letters + "$._-"
+SSA_CHARS = SSA_DIGITS + SSA_START_CHARS
+
 # Regex command to match an SSA identifier.
-SSA_RE_STR = "[0-9]+|[a-zA-Z$._-][a-zA-Z0-9$._-]*"
+SSA_RE_STR = f"[{SSA_DIGITS}]+|[{re.escape(SSA_START_CHARS)}][{re.escape(SSA_CHARS)}]*"
 SSA_RE = re.compile(SSA_RE_STR)
 
 
+# Return the length of the SSA identifier (as matched by SSA_RE) at the start of
+# the given chunk; stripping the character classes directly is cheaper than
+# dispatching into the regex engine for every name.
+def ssa_name_len(chunk: str) -> int:
+    # Names starting with a digit are purely numeric.
+    if chunk and chunk[0] in SSA_DIGITS:
+        return len(chunk) - len(chunk.lstrip(SSA_DIGITS))
+    return len(chunk) - len(chunk.lstrip(SSA_CHARS))
+
+
 # Class used to generate and manage string substitution blocks for SSA value
 # names.
 class SSAVariableNamer:
     def __init__(self):
-        self.scopes = []
-        self.name_counter = 0
+        # All names visible from the innermost scope, mapped to their variable.
+        self.flat: Dict[str, str] = {}
+        # The names added by each pushed scope, so they can be dropped on pop.
+        self.scope_keys: List[List[str]] = []
+        self.name_counter: int = 0
 
     # Generate a substitution name for the given ssa value name.
-    def generate_name(self, ssa_name):
-        variable = "VAL_" + str(self.name_counter)
+    def generate_name(self, ssa_name: str) -> str:
+        variable = f"VAL_{self.name_counter}"
         self.name_counter += 1
-        self.scopes[-1][ssa_name] = variable
+        self.scope_keys[-1].append(ssa_name)
+        self.flat[ssa_name] = variable
         return variable
 
     # Push a new variable name scope.
-    def push_name_scope(self):
-        self.scopes.append({})
+    def push_name_scope(self) -> None:
+        self.scope_keys.append([])
 
     # Pop the last variable name scope.
-    def pop_name_scope(self):
-        self.scopes.pop()
-
-    # Return the level of nesting (number of pushed scopes).
-    def num_scopes(self):
-        return len(self.scopes)
+    def pop_name_scope(self) -> None:
+        # process_line only generates a name when no scope already binds it, so
+        # an inner name never shadows an outer one (even if the IR reuses a
+        # name in a nested region) and can simply be deleted.
+        for ssa_name in self.scope_keys.pop():
+            del self.flat[ssa_name]
 
     # Reset the counter.
-    def clear_counter(self):
+    def clear_counter(self) -> None:
         self.name_counter = 0
 
 
 # Process a line of input that has been split at each SSA identifier '%'.
-def process_line(line_chunks, variable_namer):
-    output_line = ""
+def process_line(line_chunks: List[str], variable_namer: SSAVariableNamer) -> str:
+    output_parts: List[str] = []
+    # Every visible name is in the namer's flat map, so a single lookup per
+    # name decides between reusing and generating a variable.
+    lookup_name = variable_namer.flat.get
 
     # Process the rest that contained an SSA value name.
     for chunk in line_chunks:
-        m = SSA_RE.match(chunk)
-        ssa_name = m.group(0)
+        name_len = ssa_name_len(chunk)
+        # A '%' that doesn't start an SSA name (e.g. "100% done" in a string
+        # attribute) is kept as is.
+        if not name_len:
+            output_parts.append("%" + chunk)
+            continue
+        ssa_name = chunk[:name_len]
 
         # Check if an existing variable exists for this name.
-        variable = None
-        for scope in variable_namer.scopes:
-            variable = scope.get(ssa_name)
-            if variable is not None:
-                break
+        variable = lookup_name(ssa_name)
 
         # If one exists, then output the existing name.
         if variable is not None:
-            output_line += "%[[" + variable + "]]"
+            output_parts.append(f"%[[{variable}]]")
         else:
             # Otherwise, generate a new variable.
             variable = variable_namer.generate_name(ssa_name)
-            output_line += "%[[" + variable + ":.*]]"
+            output_parts.append(f"%[[{variable}:.*]]")
 
         # Append the non named group.
-        output_line += chunk[len(ssa_name) :]
+        output_parts.append(chunk[name_len:])
 
-    return output_line.rstrip() + "\n"
+    return "".join(output_parts).rstrip() + "\n"
 
 
 # Process the source file lines. The source file doesn't have to be .mlir.
 def process_source_lines(source_lines, note, args):
-    source_split_re = re.compile(args.source_delim_regex)
+    split_search = re.compile(args.source_delim_regex).search
+    check_prefix = args.check_prefix
 
     source_segments = [[]]
     for line in source_lines:
@@ -89,10 +117,10 @@ def process_source_lines(source_lines, note, args):
         if line == note:
             continue
         # Remove previous CHECK lines.
-        if line.find(args.check_prefix) != -1:
+        if check_prefix in line:
             continue
         # Segment the file based on --source_delim_regex.
-        if source_split_re.search(line):
+        if split_search(line):
             source_segments.append([])
 
         source_segments[-1].append(line + "\n")
@@ -101,7 +129,16 @@ def process_source_lines(source_lines, note, args):
 
 # Pre-process a line of input to remove any character sequences that will be
 # problematic with FileCheck.
-def preprocess_line(line):
+def preprocess_line(line: str) -> str:
+    # Only brackets need escaping, so most lines are returned untouched.
+    if "[" not in line:
+        return line
+    return _preprocess_bracketed_line(line)
+
+
+# Escape the brackets of a line; memoized since IR tends to repeat lines.
+@functools.lru_cache(maxsize=4096)
+def _preprocess_bracketed_line(line: str) -> str:
     # Replace any double brackets, '[[' with escaped replacements. '[['
     # corresponds to variable names in FileCheck.
     output_line = line.replace("[[", "{{\\[\\[}}")
@@ -117,96 +154,132 @@ def preprocess_line(line):
 def main(input, starts_from_scope=False, check_prefix="# CHECK", output=None):
     input = str(input)
     # Open the given input file.
-    input_lines = [l.rstrip() for l in input.splitlines()]
+    input_lines = input.split("\n")
 
-    source_segments = None
     if output is None:
         output = io.StringIO()
 
-    output_segments = [[]]
+    # Check lines are streamed straight to the output as they are generated, so
+    # if processing fails partway through, the lines before it have already
+    # been written to the given output. Each segment starts with a newline.
+    emit = output.write
+    emit("\n")
+    # Whether the current segment has had a check line emitted yet.
+    segment_has_checks = False
     # A map containing data used for naming SSA value names.
     variable_namer = SSAVariableNamer()
+    # The level of nesting (number of pushed name scopes).
+    depth = 0
     for input_line in input_lines:
+        # rstrip returns the line itself when there is nothing to strip, and
+        # also drops the '\r' of '\r\n' line endings.
+        input_line = input_line.rstrip()
         if not input_line:
             continue
-        lstripped_input_line = input_line.lstrip()
+        # Only the first non-whitespace character is needed; lstrip finds it in
+        # C, which is faster than scanning the indentation in Python.
+        first_char = input_line.lstrip()[0]
 
         # Lines with blocks begin with a ^. These lines have a trailing comment
         # that needs to be stripped.
-        is_block = lstripped_input_line[0] == "^"
+        is_block = first_char == "^"
         if is_block:
-            input_line = input_line.rsplit("//", 1)[0].rstrip()
+            comment_start = input_line.rfind("//")
+            if comment_start != -1:
+                input_line = input_line[:comment_start].rstrip()
 
-        cur_level = variable_namer.num_scopes()
+        cur_level = depth
 
         # If the line starts with a '}', pop the last name scope.
-        if lstripped_input_line[0] == "}":
+        if first_char == "}":
             variable_namer.pop_name_scope()
-            cur_level = variable_namer.num_scopes()
+            depth -= 1
+            cur_level = depth
 
         # If the line ends with a '{', push a new name scope.
         if input_line[-1] == "{":
             variable_namer.push_name_scope()
+            depth += 1
             if cur_level == starts_from_scope:
-                output_segments.append([])
+                segment_has_checks = False
+                emit("\n")
 
-        # Omit lines at the near top level e.g. "module {".
-        if cur_level < starts_from_scope:
+        # Omit lines at the near top level e.g. "module {". Nothing is omitted
+        # in the common case of starting from the outermost scope.
+        if starts_from_scope and cur_level < starts_from_scope:
             continue
 
-        if len(output_segments[-1]) == 0:
+        if not segment_has_checks:
             variable_namer.clear_counter()
 
         # Preprocess the input to remove any sequences that may be problematic with
         # FileCheck.
         input_line = preprocess_line(input_line)
 
+        # Lines without any SSA value names are emitted verbatim.
+        if "%" not in input_line:
+            if segment_has_checks:
+                output_line = check_prefix + ": " + " " * len("-LABEL")
+            else:
+                output_line = check_prefix + "-LABEL: "
+            emit(output_line + input_line + "\n")
+            segment_has_checks = True
+            continue
+
         # Split the line at the each SSA value name.
         ssa_split = input_line.split("%")
 
         # If this is a top-level operation use 'CHECK-LABEL', otherwise 'CHECK:'.
-        if len(output_segments[-1]) != 0 or not ssa_split[0]:
-            output_line = check_prefix + ": "
+        if segment_has_checks or not ssa_split[0]:
+            output_parts = [check_prefix, ": "]
             # Pad to align with the 'LABEL' statements.
-            output_line += " " * len("-LABEL")
+            output_parts.append(" " * len("-LABEL"))
 
             # Output the first line chunk that does not contain an SSA name.
-            output_line += ssa_split[0]
+            output_parts.append(ssa_split[0])
 
             # Process the rest of the input line.
-            output_line += process_line(ssa_split[1:], variable_namer)
+            output_parts.append(process_line(ssa_split[1:], variable_namer))
 
         else:
             # Output the first line chunk that does not contain an SSA name for the
             # label.
-            output_line = check_prefix + "-LABEL: " + ssa_split[0] + "\n"
+            output_parts = [check_prefix, "-LABEL: ", ssa_split[0], "\n"]
 
-            # Process the rest of the input line on separate check lines.
+            # Process the rest of the input line on separate check lines, padded
+            # to align with the original position in the line.
+            same_prefix = check_prefix + "-SAME:  " + " " * len(ssa_split[0])
             for argument in ssa_split[1:]:
-                output_line += check_prefix + "-SAME:  "
-
-                # Pad to align with the original position in the line.
-                output_line += " " * len(ssa_split[0])
+                output_parts.append(same_prefix)
 
                 # Process the rest of the line.
-                output_line += process_line([argument], variable_namer)
+                output_parts.append(process_line([argument], variable_namer))
 
         # Append the output line.
-        output_segments[-1].append(output_line)
-
-    # Write the output.
-    if source_segments:
-        assert len(output_segments) == len(source_segments)
-        for check_segment, source_segment in zip(output_segments, source_segments):
-            for line in check_segment:
-                output.write(line)
-            for line in source_segment:
-                output.write(line)
-    else:
-        for segment in output_segments:
-            output.write("\n")
-            for output_line in segment:
-                output.write(output_line)
-        output.write("\n")
+        emit("".join(output_parts))
+        segment_has_checks = True
+
+    emit("\n")
 
     return output.getvalue()
+
+
+# Generate the checks for a single input file.
+def _main_file(path, starts_from_scope, check_prefix):
+    from pathlib import Path
+
+    return main(Path(path).read_text(), starts_from_scope, check_prefix)
+
+
+# Generate the checks for many input files, one per worker process; the
+# outputs are returned in the order of the given paths.
+def main_many(paths, starts_from_scope=False, check_prefix="# CHECK", max_workers=None):
+    # Imported here so that importing this module doesn't pull in
+    # multiprocessing for a rarely used helper.
+    from concurrent.futures import ProcessPoolExecutor
+
+    worker = functools.partial(
+        _main_file, starts_from_scope=starts_from_scope, check_prefix=check_prefix
+    )
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(worker, paths, chunksize=8))
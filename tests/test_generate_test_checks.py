@@ -0,0 +1,95 @@
+from textwrap import dedent
+
+import pytest
+
+from mlir.extras.testing.generate_test_checks import (
+    SSA_RE,
+    SSAVariableNamer,
+    main,
+    main_many,
+    process_line,
+    ssa_name_len,
+)
+
+
+def test_main_many(tmp_path):
+    inputs = [
+        dedent("""\
+        func.func @a(%x: i32) {
+          %0 = arith.addi %x, %x : i32
+        }
+        """),
+        dedent("""\
+        func.func @b() {
+          %c1 = arith.constant 1 : i32
+        }
+        """),
+    ]
+    paths = []
+    for i, input in enumerate(inputs):
+        path = tmp_path / f"input_{i}.mlir"
+        path.write_text(input)
+        paths.append(path)
+
+    assert main_many(paths, check_prefix="// CHECK") == [
+        main(input, check_prefix="// CHECK") for input in inputs
+    ]
+
+
+def test_stray_percent():
+    input = dedent("""\
+    func.func @a() {
+      %0 = "foo"() {msg = "100% done"} : () -> i32
+      %1 = "bar"(%0) {msg = "trailing %"} : (i32) -> i32
+    }
+    """)
+    correct = "\n".join(
+        [
+            "",
+            "",
+            "# CHECK-LABEL: func.func @a() {",
+            '# CHECK:         %[[VAL_0:.*]] = "foo"() {msg = "100% done"} : () -> i32',
+            '# CHECK:         %[[VAL_1:.*]] = "bar"(%[[VAL_0]]) {msg = "trailing %"} : (i32) -> i32',
+            "# CHECK:       }",
+            "",
+            "",
+        ]
+    )
+    assert main(input) == correct
+
+
+@pytest.mark.parametrize(
+    "chunk",
+    ["123abc", "$q", "_z-1", "9.a", "arg0", "arg0: i32", "", " arg0", "-", "0"],
+)
+def test_ssa_name_len(chunk):
+    m = SSA_RE.match(chunk)
+    assert ssa_name_len(chunk) == (m.end() if m else 0)
+
+
+def test_ssa_variable_namer_scopes():
+    namer = SSAVariableNamer()
+    namer.push_name_scope()
+    assert process_line(["arg0: i32"], namer) == "%[[VAL_0:.*]]: i32\n"
+
+    # A nested scope reuses the outer name instead of shadowing it.
+    namer.push_name_scope()
+    assert (
+        process_line(["0 = foo ", "arg0"], namer) == "%[[VAL_1:.*]] = foo %[[VAL_0]]\n"
+    )
+    namer.pop_name_scope()
+    assert namer.flat == {"arg0": "VAL_0"}
+
+    # A sibling scope generates the popped name afresh.
+    namer.push_name_scope()
+    assert (
+        process_line(["0 = bar ", "arg0"], namer) == "%[[VAL_2:.*]] = bar %[[VAL_0]]\n"
+    )
+    namer.pop_name_scope()
+    namer.pop_name_scope()
+    assert namer.flat == {}
+
+    # As does a sibling of the outer scope, for the outer name.
+    namer.push_name_scope()
+    assert process_line(["arg0"], namer) == "%[[VAL_3:.*]]\n"
+    assert namer.flat == {"arg0": "VAL_3"}